@@ -0,0 +1,125 @@
+"""
+Cache Helper Functions
+
+Redis helpers for read-through caching of API responses.
+When REDIS_URL is not set, or Redis is unreachable, the cache helpers behave as
+a miss / no-op so callers fall back to MongoDB.
+"""
+
+import os
+import logging
+from typing import Any, Optional
+
+import orjson
+from dotenv import load_dotenv
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+redis = None
+
+redis_url = os.getenv("REDIS_URL")
+
+# Stream that /api/send-email writes to and email_worker.py reads from
+EMAIL_STREAM = "emails"
+
+# Cap on queued jobs kept per stream; older, already-handled entries are trimmed
+STREAM_MAXLEN = 10000
+
+
+def connect():
+    """Create the Redis client once (call from the app startup hook)"""
+    global redis
+    if redis is None and redis_url:
+        redis = Redis.from_url(redis_url)
+    return redis
+
+
+async def disconnect():
+    """Close the Redis client (call from the app shutdown hook)"""
+    global redis
+    if redis is not None:
+        await redis.aclose()
+    redis = None
+
+
+async def cache_get(key: str) -> Optional[Any]:
+    """Return the cached JSON value for key, or None on a miss"""
+    if redis is None:
+        return None
+    try:
+        cached = await redis.get(key)
+    except RedisError:
+        logger.warning("Cache read failed for %s", key, exc_info=True)
+        return None
+    return orjson.loads(cached) if cached is not None else None
+
+
+async def cache_set(key: str, value: Any, ttl: int):
+    """Store value as JSON under key for ttl seconds"""
+    if redis is None:
+        return
+    try:
+        await redis.setex(key, ttl, orjson.dumps(value))
+    except RedisError:
+        logger.warning("Cache write failed for %s", key, exc_info=True)
+
+
+async def cache_delete(*keys: str):
+    """Drop cached entries so the next read goes back to MongoDB"""
+    if redis is None or not keys:
+        return
+    try:
+        await redis.delete(*keys)
+    except RedisError:
+        logger.warning("Cache delete failed for %s", ", ".join(keys), exc_info=True)
+
+
+# INCR only an existing counter: a missing key (new Redis, FLUSH, eviction)
+# returns nil so the caller re-seeds it instead of restarting at 1
+_INCR_EXISTING = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+  return redis.call('INCR', KEYS[1])
+end
+return false
+"""
+
+# Create the counter at ARGV[1], or raise it there unless it already holds a
+# larger value
+_RAISE_TO = """
+local current = redis.call('GET', KEYS[1])
+local floor = tonumber(ARGV[1])
+if not current or floor > tonumber(current) then
+  redis.call('SET', KEYS[1], floor)
+  return floor
+end
+return tonumber(current)
+"""
+
+
+async def next_sequence(key: str) -> Optional[int]:
+    """Atomically increment the counter under key.
+
+    Returns None without Redis or when the counter has not been seeded; Redis
+    errors are raised, since falling back to another counter would duplicate numbers.
+    """
+    if redis is None:
+        return None
+    return await redis.eval(_INCR_EXISTING, 1, key)
+
+
+async def seed_sequence(key: str, floor: int) -> int:
+    """Make sure the counter under key is at least floor, returning its value"""
+    return await redis.eval(_RAISE_TO, 1, key, floor)
+
+
+async def enqueue(stream: str, fields: dict) -> Optional[str]:
+    """Append a job to a Redis stream, returning its id, or None without Redis"""
+    if redis is None:
+        return None
+    message_id = await redis.xadd(stream, fields, maxlen=STREAM_MAXLEN, approximate=True)
+    return message_id.decode()
@@ -0,0 +1,104 @@
+"""
+Email Worker
+
+Consumes jobs queued by POST /api/send-email from the Redis "emails" stream
+and hands them to the email provider. Run one or more alongside the API:
+
+    python email_worker.py
+"""
+
+import asyncio
+import logging
+import os
+import socket
+
+from redis.exceptions import ResponseError
+
+import cache
+from cache import EMAIL_STREAM, STREAM_MAXLEN
+
+logger = logging.getLogger("email_worker")
+
+GROUP = "email-workers"
+# Unique per process so several workers can share the consumer group
+CONSUMER = f"{socket.gethostname()}-{os.getpid()}"
+# Messages left pending this long (a crashed worker or a failed delivery)
+# are claimed again
+RECLAIM_IDLE_MS = 60000
+# Deliveries attempted before a message is moved to the dead-letter stream
+MAX_DELIVERIES = 5
+DEAD_LETTER_STREAM = f"{EMAIL_STREAM}:dead"
+
+
+async def deliver(to: str, subject: str, html: str, text: str):
+    # Demo email sender: In a real system, integrate with SendGrid or similar
+    logger.info("Sending email to %s: %s", to, subject)
+
+
+async def handle(redis, message_id, fields):
+    if fields is None:
+        # Entry was trimmed from the stream while pending
+        await redis.xack(EMAIL_STREAM, GROUP, message_id)
+        return
+    job = {k.decode(): v.decode() for k, v in fields.items()}
+    try:
+        await deliver(job["to"], job["subject"], job["html"], job["text"])
+    except Exception:
+        # Leave it pending; it is retried once RECLAIM_IDLE_MS has passed, up
+        # to MAX_DELIVERIES times
+        logger.exception("Delivery of %s failed", message_id)
+        return
+    await redis.xack(EMAIL_STREAM, GROUP, message_id)
+
+
+async def dead_letter(redis):
+    """Move messages that failed MAX_DELIVERIES times out of the retry loop"""
+    pending = await redis.xpending_range(
+        EMAIL_STREAM, GROUP, min="-", max="+", count=100, idle=RECLAIM_IDLE_MS
+    )
+    for entry in pending:
+        if entry["times_delivered"] < MAX_DELIVERIES:
+            continue
+        message_id = entry["message_id"]
+        entries = await redis.xrange(EMAIL_STREAM, message_id, message_id)
+        if entries:
+            await redis.xadd(DEAD_LETTER_STREAM, entries[0][1], maxlen=STREAM_MAXLEN, approximate=True)
+        await redis.xack(EMAIL_STREAM, GROUP, message_id)
+        logger.error("Moved %s to %s after %d delivery attempts", message_id, DEAD_LETTER_STREAM, entry["times_delivered"])
+
+
+async def reclaim(redis):
+    """Retry messages whose delivery failed or whose worker died"""
+    await dead_letter(redis)
+    start = "0-0"
+    while True:
+        start, messages, *_ = await redis.xautoclaim(
+            EMAIL_STREAM, GROUP, CONSUMER, min_idle_time=RECLAIM_IDLE_MS, start_id=start, count=10
+        )
+        for message_id, fields in messages:
+            await handle(redis, message_id, fields)
+        if start in (b"0-0", "0-0"):
+            return
+
+
+async def run():
+    redis = cache.connect()
+    if redis is None:
+        raise SystemExit("REDIS_URL is not set")
+
+    try:
+        await redis.xgroup_create(EMAIL_STREAM, GROUP, id="0", mkstream=True)
+    except ResponseError:
+        pass  # group already exists
+
+    while True:
+        await reclaim(redis)
+        batches = await redis.xreadgroup(GROUP, CONSUMER, {EMAIL_STREAM: ">"}, count=10, block=5000)
+        for _, messages in batches:
+            for message_id, fields in messages:
+                await handle(redis, message_id, fields)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run())
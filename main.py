@@ -1,36 +1,131 @@
 import os
-from fastapi import FastAPI, HTTPException
+import re
+import logging
+import asyncio
+import hashlib
+import time
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.responses import HTMLResponse, ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field
+from typing import List, Optional, Tuple
 from datetime import datetime, timezone
 from bson import ObjectId
+from jinja2 import Environment
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument
+from pymongo.errors import PyMongoError
+from redis.exceptions import RedisError
 
-from database import db, create_document, get_documents
+from database import connect, disconnect, create_document, get_documents
+import cache
+from cache import cache_get, cache_set, cache_delete, next_sequence, seed_sequence, enqueue, EMAIL_STREAM
 
-app = FastAPI(title="TRI API", version="1.0.0")
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="TRI API", version="1.0.0", default_response_class=ORJSONResponse)
+
+# Motor database handle, set once the client is created at startup
+db = None
+
+# Comma-separated list of frontend origins, e.g. "https://tri.example.com"
+cors_origins = [o.strip() for o in os.getenv("CORS_ORIGINS", "*").split(",") if o.strip()]
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=cors_origins,
+    # Starlette answers any Origin when "*" is combined with credentials, so
+    # cookies/auth headers are only allowed for an explicit origin list
+    allow_credentials="*" not in cors_origins,
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type", "authorization"],
+    # Let browsers reuse the preflight result for a day
+    max_age=86400,
 )
 
 
+ORDER_INDEXES = [
+    # list_orders: equality on user_email, index-backed sort on created_at
+    IndexModel([("user_email", ASCENDING), ("created_at", DESCENDING)]),
+    # verify_payment / get_invoice lookups; documents without an
+    # order_id are left out of the uniqueness check
+    IndexModel(
+        [("order_id", ASCENDING)],
+        unique=True,
+        partialFilterExpression={"order_id": {"$exists": True}},
+    ),
+    # Finding the last issued invoice number when seeding the counter
+    IndexModel(
+        [("invoice_year", DESCENDING), ("invoice_seq", DESCENDING)],
+        partialFilterExpression={"invoice_seq": {"$exists": True}},
+    ),
+    # Same lookup for orders paid before invoice_seq was stored
+    IndexModel(
+        [("invoice_number", DESCENDING)],
+        partialFilterExpression={"invoice_number": {"$exists": True}},
+    ),
+]
+
+
+@app.on_event("startup")
+async def startup():
+    global db
+    db = connect()
+    cache.connect()
+    if db is not None:
+        # Index problems must not keep the API from starting; /test still
+        # reports connectivity errors. Each index is built on its own so one
+        # failure (e.g. legacy duplicate order_ids) doesn't take the others down
+        for index in ORDER_INDEXES:
+            try:
+                await db["order"].create_indexes([index])
+            except PyMongoError:
+                logger.exception("Could not create order index %s", index.document["name"])
+        try:
+            await _migrate_legacy_sequence()
+            await _sync_invoice_sequence()
+        except (PyMongoError, RedisError):
+            logger.exception("Could not sync the invoice sequence")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    global db
+    disconnect()
+    db = None
+    await cache.disconnect()
+
+
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "TRI Backend Running"}
 
 
 @app.get("/api/hello")
-def hello():
+async def hello():
     return {"message": "Hello from TRI backend API!"}
 
 
+@app.get("/health")
+async def health():
+    return {"ok": True}
+
+
+# (monotonic timestamp, collection names) from the last /test lookup
+_collections_cache = None
+COLLECTIONS_CACHE_TTL = 10
+
+
+async def _list_collections() -> List[str]:
+    global _collections_cache
+    if _collections_cache is not None and time.monotonic() - _collections_cache[0] < COLLECTIONS_CACHE_TTL:
+        return _collections_cache[1]
+    names = await db.list_collection_names()
+    _collections_cache = (time.monotonic(), names)
+    return names
+
+
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -47,7 +142,7 @@ def test_database():
             response["database_name"] = db.name if hasattr(db, 'name') else "❌ Unknown"
             response["connection_status"] = "Connected"
             try:
-                response["collections"] = db.list_collection_names()
+                response["collections"] = await _list_collections()
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
                 response["database"] = f"⚠️ Connected but Error: {str(e)[:80]}"
@@ -59,61 +154,210 @@ def test_database():
     return response
 
 
+# Request bodies are read-only once validated. Frozen only makes models with
+# hashable fields hashable; OrderIn holds a list and is not
+class RequestModel(BaseModel):
+    model_config = ConfigDict(
+        extra="ignore",
+        validate_assignment=False,
+        str_strip_whitespace=False,
+        frozen=True,
+    )
+
+
 # Models mirroring schemas
-class CartItem(BaseModel):
+class CartItem(RequestModel):
     product_id: str
     title: str
     quantity: int
-    price: float
+    price_paise: int = Field(..., ge=0)
 
-class OrderIn(BaseModel):
+class OrderIn(RequestModel):
     user_email: str
     items: List[CartItem]
 
-class VerifyPaymentIn(BaseModel):
+class VerifyPaymentIn(RequestModel):
     order_id: str
     payment_id: Optional[str] = None
     signature: Optional[str] = None
 
 
-def _generate_invoice_number() -> str:
-    seq = db["invoicesequence"].find_one_and_update(
-        {"_id": "seq"},
-        {"$inc": {"last_number": 1}},
+# Current year and the timestamp at which it rolls over
+_year = None
+_next_year_at = 0.0
+
+
+def _current_year() -> int:
+    global _year, _next_year_at
+    if time.time() >= _next_year_at:
+        _year = datetime.now().year
+        _next_year_at = datetime(_year + 1, 1, 1).timestamp()
+    return _year
+
+
+def _invoice_prefix(year: int) -> str:
+    return f"TRI/{year}/"
+
+
+async def _last_issued_invoice(year: int) -> int:
+    """Highest invoice number issued for year.
+
+    The numbers stored on paid orders are the source of truth; the Mongo
+    counter document covers numbers issued while Redis was not in use.
+    Orders carry the number as an integer (invoice_year/invoice_seq) so it
+    sorts numerically; orders paid before that field existed only have the
+    string, which sorts correctly up to its 5-digit padding.
+    """
+    prefix = _invoice_prefix(year)
+    seq, last_order, last_legacy_order = await asyncio.gather(
+        db["invoicesequence"].find_one({"_id": f"seq:{year}"}),
+        db["order"].find_one(
+            {"invoice_year": year},
+            {"invoice_seq": 1},
+            sort=[("invoice_year", DESCENDING), ("invoice_seq", DESCENDING)],
+        ),
+        db["order"].find_one(
+            {"invoice_number": {"$regex": f"^{re.escape(prefix)}"}, "invoice_seq": {"$exists": False}},
+            {"invoice_number": 1},
+            sort=[("invoice_number", DESCENDING)],
+        ),
+    )
+    last = seq["last_number"] if seq else 0
+    if last_order:
+        last = max(last, last_order["invoice_seq"])
+    if last_legacy_order:
+        last = max(last, int(last_legacy_order["invoice_number"][len(prefix):]))
+    return last
+
+
+async def _migrate_legacy_sequence():
+    """Carry the old year-agnostic {_id: "seq"} counter into this year's document.
+
+    The legacy document is removed afterwards so later years start from 1.
+    """
+    legacy = await db["invoicesequence"].find_one({"_id": "seq"})
+    if legacy is None:
+        return
+    await db["invoicesequence"].update_one(
+        {"_id": f"seq:{_current_year()}"},
+        {"$max": {"last_number": legacy.get("last_number", 0)}},
         upsert=True,
-        return_document=True,
     )
-    num = seq.get("last_number", 1)
-    year = datetime.now().year
-    return f"TRI/{year}/{num:05d}"
+    await db["invoicesequence"].delete_one({"_id": "seq"})
 
 
-def _order_total(items: List[CartItem]) -> float:
-    return float(sum(i.price * i.quantity for i in items))
+async def _sync_invoice_sequence():
+    """Bring the active counter up to the last issued number for this year.
+
+    Run at startup so switching Redis on or off never reissues a number.
+    """
+    year = _current_year()
+    last = await _last_issued_invoice(year)
+    if cache.redis is not None:
+        await seed_sequence(f"seq:invoice:{year}", last)
+    else:
+        await db["invoicesequence"].update_one(
+            {"_id": f"seq:{year}"}, {"$max": {"last_number": last}}, upsert=True
+        )
+
+
+async def _next_invoice_sequence() -> Tuple[int, int]:
+    """Take the next invoice number, returned as (year, sequence)"""
+    year = _current_year()
+    if cache.redis is None:
+        seq = await db["invoicesequence"].find_one_and_update(
+            {"_id": f"seq:{year}"},
+            {"$inc": {"last_number": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        num = seq["last_number"]
+    else:
+        # Redis INCR is atomic across workers and avoids serializing every
+        # paid order through a single MongoDB document. The key has no TTL,
+        # so volatile-* eviction policies leave it alone; if it is lost anyway
+        # it is re-seeded from the issued numbers rather than restarting at 1
+        key = f"seq:invoice:{year}"
+        num = await next_sequence(key)
+        if num is None:
+            await seed_sequence(key, await _last_issued_invoice(year))
+            num = await next_sequence(key)
+            if num is None:
+                raise RuntimeError(f"Invoice counter {key} could not be seeded")
+    return year, num
+
+
+def _format_invoice_number(year: int, num: int) -> str:
+    return f"{_invoice_prefix(year)}{num:05d}"
+
+
+# Maximum number of orders returned by list_orders
+ORDER_LIST_LIMIT = 50
+
+# Fields needed to render the order history list
+ORDER_SUMMARY_PROJECTION = {
+    "order_id": 1,
+    "items": 1,
+    "amount": 1,
+    "amount_unit": 1,
+    "status": 1,
+    "invoice_number": 1,
+    "created_at": 1,
+}
+
+
+def _order_total(items: List[CartItem]) -> int:
+    """Order total in integer paise, exact with no float rounding"""
+    return sum(i.price_paise * i.quantity for i in items)
+
+
+def _in_paise(order: dict) -> dict:
+    """Convert an order stored before amounts moved to integer paise.
+
+    Such orders have no amount_unit and hold float rupee price/amount values.
+    """
+    if order.get("amount_unit") == "paise":
+        return order
+    if order.get("amount") is not None:
+        order["amount"] = round(order["amount"] * 100)
+    for item in order.get("items", []):
+        if "price_paise" not in item and "price" in item:
+            item["price_paise"] = round(item.pop("price") * 100)
+    order["amount_unit"] = "paise"
+    return order
 
 
 @app.post("/api/orders")
-def create_order(payload: OrderIn):
+async def create_order(payload: OrderIn):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
 
     amount = _order_total(payload.items)
+    # Allocate the _id client-side so the simulated gateway order id can be
+    # stored with the initial insert instead of a follow-up update. The whole
+    # ObjectId is used: its last bytes alone can repeat across worker processes
+    oid = ObjectId()
+    now = datetime.now(timezone.utc)
+    gateway_order_id = f"order_{oid}"
     doc = {
+        "_id": oid,
+        "order_id": gateway_order_id,
         "user_email": payload.user_email,
-        "items": [i.model_dump() for i in payload.items],
+        "items": payload.model_dump(mode="python")["items"],
         "amount": amount,
+        "amount_unit": "paise",
         "status": "created",
-        "created_at": datetime.now(timezone.utc),
-        "updated_at": datetime.now(timezone.utc),
+        "created_at": now,
+        "updated_at": now,
+        # Lifecycle audit trail, written with the order itself so logging an
+        # event never costs an extra round trip or outlives a failed write
+        "events": [{"event": "created", "amount": amount, "at": now}],
     }
-    result = db["order"].insert_one(doc)
-
-    # Simulate gateway order id
-    gateway_order_id = f"order_{str(result.inserted_id)[-8:]}"
-    db["order"].update_one({"_id": result.inserted_id}, {"$set": {"order_id": gateway_order_id}})
+    await db["order"].insert_one(doc)
+    await cache_delete(f"orders:{payload.user_email}")
 
     return {
-        "_id": str(result.inserted_id),
+        "_id": str(oid),
         "order_id": gateway_order_id,
         "amount": amount,
         "currency": "INR",
@@ -121,82 +365,137 @@ def create_order(payload: OrderIn):
     }
 
 
+async def _release_claim(order_oid: ObjectId):
+    """Put a claimed order back to created so the payment can be verified again.
+
+    If this fails too, the order stays paid without an invoice number, which
+    verify_payment also accepts and finishes on retry.
+    """
+    try:
+        await db["order"].update_one(
+            {"_id": order_oid, "invoice_number": {"$exists": False}},
+            {"$set": {"status": "created"}, "$unset": {"payment_id": ""}},
+        )
+    except PyMongoError:
+        logger.exception("Could not release the claim on order %s", order_oid)
+
+
 @app.post("/api/payments/verify")
-def verify_payment(payload: VerifyPaymentIn):
+async def verify_payment(payload: VerifyPaymentIn):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
 
-    order = db["order"].find_one({"order_id": payload.order_id})
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-
     # Demo verification: treat any request with order_id as success
-    invoice_number = _generate_invoice_number()
-    db["order"].update_one(
-        {"_id": order["_id"]},
+    now = datetime.now(timezone.utc)
+    # Claim the order before taking an invoice number: matching on status
+    # makes the transition atomic, so unknown orders, already-paid orders and
+    # the losing side of concurrent verify requests never use up a number.
+    # A paid order without an invoice number is a claim whose second write
+    # never landed; it can be claimed again to finish it
+    order = await db["order"].find_one_and_update(
+        {"order_id": payload.order_id, "$or": [
+            {"status": "created"},
+            {"status": "paid", "invoice_number": {"$exists": False}},
+        ]},
         {"$set": {
             "status": "paid",
-            "payment_id": payload.payment_id or f"pay_{str(order['_id'])[-6:]}",
-            "invoice_number": invoice_number,
-            "updated_at": datetime.now(timezone.utc)
-        }}
+            "payment_id": payload.payment_id or f"pay_{payload.order_id[-6:]}",
+            "updated_at": now
+        }},
+        projection={"user_email": 1},
+        return_document=ReturnDocument.AFTER,
     )
+    if not order:
+        if await db["order"].find_one({"order_id": payload.order_id}, {"_id": 1}):
+            raise HTTPException(status_code=409, detail="Order already processed")
+        raise HTTPException(status_code=404, detail="Order not found")
+
+    try:
+        year, num = await _next_invoice_sequence()
+        invoice_number = _format_invoice_number(year, num)
+        result = await db["order"].update_one(
+            {"_id": order["_id"], "invoice_number": {"$exists": False}},
+            {
+                "$set": {"invoice_number": invoice_number, "invoice_year": year, "invoice_seq": num},
+                "$push": {"events": {"event": "paid", "invoice_number": invoice_number, "at": now}},
+            },
+        )
+    except Exception:
+        logger.exception("Could not assign an invoice number to %s", payload.order_id)
+        await _release_claim(order["_id"])
+        raise HTTPException(status_code=503, detail="Invoice numbering unavailable")
+    if result.matched_count == 0:
+        # A concurrent request resuming the same claim stored its number first
+        raise HTTPException(status_code=409, detail="Order already processed")
+
+    await cache_delete(f"orders:{order['user_email']}", _invoice_cache_key(payload.order_id))
 
     return {"status": "paid", "invoice_number": invoice_number}
 
 
 @app.get("/api/orders")
-def list_orders(email: str):
+async def list_orders(email: str):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
 
-    cur = db["order"].find({"user_email": email}).sort("created_at", -1).limit(50)
+    key = f"orders:{email}"
+    cached = await cache_get(key)
+    if cached is not None:
+        return cached
+
+    # batch_size matches the limit so the whole page arrives in the first batch
+    cur = (
+        db["order"].find({"user_email": email}, ORDER_SUMMARY_PROJECTION)
+        .sort("created_at", -1)
+        .batch_size(ORDER_LIST_LIMIT)
+        .limit(ORDER_LIST_LIMIT)
+    )
     orders = []
-    for o in cur:
+    async for o in cur:
         o["_id"] = str(o["_id"])  # make JSON serializable
-        orders.append(o)
-    return {"orders": orders}
+        orders.append(_in_paise(o))
+    result = {"orders": orders}
+    await cache_set(key, result, 60)
+    return result
 
 
-@app.get("/api/invoice/{order_id}")
-def get_invoice(order_id: str):
+@app.get("/api/orders/{order_id}")
+async def get_order(order_id: str):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
 
-    order = db["order"].find_one({"order_id": order_id})
+    order = await db["order"].find_one({"order_id": order_id})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
+    order["_id"] = str(order["_id"])  # make JSON serializable
+    return _in_paise(order)
 
-    inv = order.get("invoice_number", "PENDING")
-    items_html = "".join([
-        f"<tr><td>{i['title']}</td><td style='text-align:center'>{i['quantity']}</td><td style='text-align:right'>₹{i['price']:.2f}</td><td style='text-align:right'>₹{i['price']*i['quantity']:.2f}</td></tr>"
-        for i in order.get("items", [])
-    ])
-    html = f"""
+
+INVOICE_HTML = """
     <html>
       <head>
         <meta charset='utf-8' />
-        <title>Invoice {inv}</title>
+        <title>Invoice {{ inv }}</title>
         <style>
-          body {{ font-family: -apple-system, Segoe UI, Roboto, sans-serif; padding: 24px; }}
-          .card {{ max-width: 720px; margin: 0 auto; border: 1px solid #eee; border-radius: 10px; overflow: hidden; }}
-          .header {{ background: #0ea5e9; color: white; padding: 16px 20px; }}
-          .section {{ padding: 16px 20px; }}
-          table {{ width: 100%; border-collapse: collapse; }}
-          th, td {{ padding: 8px; border-bottom: 1px solid #f1f5f9; }}
-          th {{ text-align: left; background:#f8fafc; }}
-          .right {{ text-align:right; }}
+          body { font-family: -apple-system, Segoe UI, Roboto, sans-serif; padding: 24px; }
+          .card { max-width: 720px; margin: 0 auto; border: 1px solid #eee; border-radius: 10px; overflow: hidden; }
+          .header { background: #0ea5e9; color: white; padding: 16px 20px; }
+          .section { padding: 16px 20px; }
+          table { width: 100%; border-collapse: collapse; }
+          th, td { padding: 8px; border-bottom: 1px solid #f1f5f9; }
+          th { text-align: left; background:#f8fafc; }
+          .right { text-align:right; }
         </style>
       </head>
       <body>
         <div class="card">
           <div class="header">
             <h2>TRI Invoice</h2>
-            <div>{inv}</div>
+            <div>{{ inv }}</div>
           </div>
           <div class="section">
-            <div><strong>Billed To:</strong> {order.get('user_email')}</div>
-            <div><strong>Date:</strong> {datetime.now().strftime('%Y-%m-%d')}</div>
+            <div><strong>Billed To:</strong> {{ order.user_email }}</div>
+            <div><strong>Date:</strong> {{ today }}</div>
           </div>
           <div class="section">
             <table>
@@ -204,8 +503,8 @@ def get_invoice(order_id: str):
                 <tr><th>Description</th><th style='text-align:center'>Qty</th><th class='right'>Rate</th><th class='right'>Amount</th></tr>
               </thead>
               <tbody>
-                {items_html}
-                <tr><td colspan="3" class='right'><strong>Total</strong></td><td class='right'><strong>₹{order.get('amount', 0):.2f}</strong></td></tr>
+                {% for i in order.get("items", []) %}<tr><td>{{ i.title }}</td><td style='text-align:center'>{{ i.quantity }}</td><td style='text-align:right'>₹{{ "%.2f"|format(i.price_paise / 100) }}</td><td style='text-align:right'>₹{{ "%.2f"|format(i.price_paise * i.quantity / 100) }}</td></tr>{% endfor %}
+                <tr><td colspan="3" class='right'><strong>Total</strong></td><td class='right'><strong>₹{{ "%.2f"|format((order.amount or 0) / 100) }}</strong></td></tr>
               </tbody>
             </table>
           </div>
@@ -213,10 +512,112 @@ def get_invoice(order_id: str):
       </body>
     </html>
     """
-    return html
 
+# Compiled once at import; autoescape keeps user-supplied emails and item
+# titles from injecting markup into the invoice
+INVOICE_TEMPLATE = Environment(autoescape=True).from_string(INVOICE_HTML)
+
+# Changes whenever the template does; part of the invoice ETag and cache key
+INVOICE_TEMPLATE_VERSION = hashlib.md5(INVOICE_HTML.encode()).hexdigest()[:8]
+
+# Fields needed to render an invoice
+INVOICE_PROJECTION = {
+    "_id": 0,
+    "items": 1,
+    "amount": 1,
+    "amount_unit": 1,
+    "user_email": 1,
+    "invoice_number": 1,
+    "status": 1,
+    "updated_at": 1,
+}
+
+# Rendered paid invoices are immutable, keep them cached for 30 days
+INVOICE_CACHE_TTL = 30 * 24 * 3600
+INVOICE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Template fragments per streamed chunk
+INVOICE_STREAM_BUFFER = 64
+
+
+def _invoice_etag(invoice_number: str) -> str:
+    return '"' + hashlib.md5(f"{INVOICE_TEMPLATE_VERSION}:{invoice_number}".encode()).hexdigest() + '"'
 
-class EmailIn(BaseModel):
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header (a list, possibly W/-prefixed) with etag"""
+    if not if_none_match:
+        return False
+    for token in if_none_match.split(","):
+        token = token.strip()
+        if token == "*" or token.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def _invoice_cache_key(order_id: str) -> str:
+    # Versioned by template so a template change never serves old cached pages
+    return f"invoice:{INVOICE_TEMPLATE_VERSION}:{order_id}"
+
+
+@app.get("/api/invoice/{order_id}")
+async def get_invoice(order_id: str, request: Request):
+    if db is None:
+        raise HTTPException(status_code=500, detail="Database not configured")
+
+    if_none_match = request.headers.get("if-none-match")
+    key = _invoice_cache_key(order_id)
+    cached = await cache_get(key)
+    if cached is not None:
+        headers = {"ETag": cached["etag"], "Cache-Control": INVOICE_CACHE_CONTROL}
+        if _etag_matches(if_none_match, cached["etag"]):
+            return Response(status_code=304, headers=headers)
+        return HTMLResponse(cached["html"], headers=headers)
+
+    # Only the fields the invoice renders are sent back and decoded
+    docs = await db["order"].aggregate([
+        {"$match": {"order_id": order_id}},
+        {"$limit": 1},
+        {"$project": INVOICE_PROJECTION},
+    ]).to_list(1)
+    if not docs:
+        raise HTTPException(status_code=404, detail="Order not found")
+    order = _in_paise(docs[0])
+
+    inv = order.get("invoice_number", "PENDING")
+    # Paid invoices never change, so browsers, proxies and Redis may all keep
+    # the rendered page
+    cacheable = order.get("status") == "paid" and inv != "PENDING"
+    headers = None
+    if cacheable:
+        etag = _invoice_etag(inv)
+        headers = {"ETag": etag, "Cache-Control": INVOICE_CACHE_CONTROL}
+        if _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+
+    # A paid invoice is dated by its payment so its bytes never change. Dates
+    # are UTC throughout; Motor hands back naive UTC datetimes
+    invoice_date = order["updated_at"] if cacheable else datetime.now(timezone.utc)
+    context = {
+        "inv": inv,
+        "order": order,
+        "today": invoice_date.strftime('%Y-%m-%d'),
+    }
+    if cacheable:
+        # The whole page is kept for Redis anyway, so render it in one go
+        html = INVOICE_TEMPLATE.render(**context)
+        await cache_set(key, {"etag": etag, "html": html}, INVOICE_CACHE_TTL)
+        return HTMLResponse(html, headers=headers)
+
+    # Stream the page as it renders; buffering groups the template's many
+    # tiny fragments into a few larger body writes
+    return StreamingResponse(
+        INVOICE_TEMPLATE.stream(**context).enable_buffering(INVOICE_STREAM_BUFFER),
+        media_type="text/html",
+    )
+
+
+class EmailIn(RequestModel):
     to: str
     subject: str
     html: Optional[str] = None
@@ -224,13 +625,32 @@ class EmailIn(BaseModel):
 
 
 @app.post("/api/send-email")
-def send_email(payload: EmailIn):
-    # Demo email sender: In a real system, integrate with SendGrid or similar
-    # Here, we just simulate success
+async def send_email(payload: EmailIn):
+    # Hand off to the Redis stream consumed by email_worker.py so the request
+    # never waits on the email provider
+    try:
+        message_id = await enqueue(EMAIL_STREAM, {
+            "to": payload.to,
+            "subject": payload.subject,
+            "html": payload.html or "",
+            "text": payload.text or "",
+        })
+    except RedisError:
+        logger.exception("Could not queue email to %s", payload.to)
+        raise HTTPException(status_code=503, detail="Email queue unavailable")
+    if message_id is None:
+        raise HTTPException(status_code=500, detail="Email queue not configured")
     return {"status": "queued", "to": payload.to}
 
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+    )
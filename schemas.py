@@ -27,16 +27,20 @@ class CartItem(BaseModel):
     product_id: str = Field(...)
     title: str = Field(...)
     quantity: int = Field(..., ge=1)
-    price: float = Field(..., ge=0)
+    price_paise: int = Field(..., ge=0, description="Unit price in paise")
 
 class Order(BaseModel):
     user_email: str = Field(..., description="Email of the ordering user")
     items: List[CartItem] = Field(...)
-    amount: float = Field(..., ge=0, description="Total order amount")
+    amount: int = Field(..., ge=0, description="Total order amount in paise")
+    amount_unit: str = Field("paise", description="Unit of amount and item prices; absent on legacy rupee orders")
     status: str = Field("created", description="created|paid|failed|cancelled|fulfilled")
     order_id: Optional[str] = Field(None, description="Gateway order id")
     payment_id: Optional[str] = Field(None, description="Gateway payment id")
     invoice_number: Optional[str] = Field(None, description="Sequential invoice number")
+    invoice_year: Optional[int] = Field(None, description="Year part of invoice_number")
+    invoice_seq: Optional[int] = Field(None, description="Numeric sequence part of invoice_number")
+    events: List[dict] = Field(default_factory=list, description="Lifecycle audit trail: created, paid, ...")
 
 class BlogPost(BaseModel):
     title: str